@@ -1,14 +1,16 @@
 from pathlib import Path
 import re
 import platform
-import boto3
 from io import BytesIO 
 import textractcaller as tc
 from textractprettyprinter.t_pretty_print import get_text_from_layout_json
 import os
+import logging
 import pypdfium2 as pdfium
 from utils.nltk_stopword import check_nltk_package
-from utils.utils_os import read_document, get_region
+from utils.utils_os import read_document, get_region, get_client
+
+logger = logging.getLogger(__name__)
 
 check_nltk_package('stopwords')
 
@@ -141,7 +143,7 @@ def encode_pdf_to_base64(file_path):
     return encoded_messages
 
 def call_bedrock_model(content: list, system_prompt: str, model_id: str, tool_config: dict = None):
-    bedrock_rt = boto3.client("bedrock-runtime")
+    bedrock_rt = get_client("bedrock-runtime")
     inference_config = {"maxTokens": 4096, "temperature": 0, "topP": 1}
     params = {
         "modelId": model_id,
@@ -307,7 +309,7 @@ def prepare_bedrock_vision_and_textract_prompt(query, encoded_images, all_text):
                 If the data the question asks for is not in the DATA then say I don't know and give an explanation why. 
                 Leave the ground truth empty if you don't know. 
                 """
-    print(encoded_messages)
+    logger.debug("Vision & Textract prompt: %s", encoded_messages)
     return encoded_messages, system_prompt
 
 def run_tool_use(tool_config, all_text, query, model_id):
@@ -331,27 +333,27 @@ def search_and_answer_pdf(file_path, query, ocr_tool, model_id):
     else:
         all_text = read_document(file_path)
     if "Vision (Experimental)" in ocr_tool:
-        print(f"Passing images to {model_id} Vision as OCR")
+        logger.debug("Passing images to %s Vision as OCR", model_id)
         encoded_images = encode_pdf_to_base64(file_path)
         prompt, system_prompt = prepare_bedrock_vision_prompt(query, encoded_images)
     elif "Vision & Textract (Experimental)" in ocr_tool:
-        print(f"Passing images to {model_id} Vision as OCR and Textract as OCR")
+        logger.debug("Passing images to %s Vision as OCR and Textract as OCR", model_id)
         encoded_images = encode_pdf_to_base64(file_path)
         prompt, system_prompt = prepare_bedrock_vision_and_textract_prompt(query, encoded_images, all_text)
     elif ocr_tool == "Textract": 
-        print(f"Passing images to {model_id} using Textract as OCR")
+        logger.debug("Passing images to %s using Textract as OCR", model_id)
         prompt, system_prompt = prepare_textract_prompt(query, all_text)
     elif ocr_tool == "Converse API - DocumentBlock (Experimental)":
         prompt, system_prompt = prepare_docblock_prompt(query, all_text, file_format)
     else: 
-        print("Not a valid OCR tool selection")
+        logger.error("Not a valid OCR tool selection: %s", ocr_tool)
     
     response_text, token_usage = call_bedrock_model(prompt, system_prompt, model_id)
     answer, ground_truth = extract_answer_and_ground_truth(response_text)
     return answer, ground_truth, all_text, token_usage
 
 def check_s3_for_text_file(bucket_name, s3_key):
-    s3 = boto3.client('s3')
+    s3 = get_client('s3')
     try:
         s3.head_object(Bucket=bucket_name, Key=s3_key)
         return True
@@ -359,7 +361,7 @@ def check_s3_for_text_file(bucket_name, s3_key):
         return False
 
 def download_text_file_from_s3(bucket_name, s3_key):
-    s3 = boto3.client('s3')
+    s3 = get_client('s3')
     try:
         obj = s3.get_object(Bucket=bucket_name, Key=s3_key)
         text_content = obj['Body'].read().decode('utf-8')
@@ -374,7 +376,8 @@ def process_pdf_with_textract(file_path, bucket_name):
     ]
     textract_json = tc.call_textract(
         input_document=f"s3://{bucket_name}/{os.path.basename(file_path)}",
-        features=features
+        features=features,
+        boto3_textract_client=get_client("textract")
     )
     
     layout = get_text_from_layout_json(
@@ -391,7 +394,7 @@ def process_pdf_with_textract(file_path, bucket_name):
     return all_text
 
 def upload_doc_to_s3(file_path, bucket_name, s3_key):
-    s3 = boto3.client('s3')
+    s3 = get_client('s3')
     s3.upload_file(
         Filename=file_path,
         Bucket=bucket_name,
@@ -399,7 +402,7 @@ def upload_doc_to_s3(file_path, bucket_name, s3_key):
     )
 
 def upload_text_to_s3(text_content, bucket_name, s3_key):
-    s3 = boto3.client('s3')
+    s3 = get_client('s3')
     s3.put_object(
         Body=text_content.encode('utf-8'),
         Bucket=bucket_name,
@@ -411,10 +414,10 @@ def create_or_retrieve_textract_file(file_path):
     s3_key = os.path.basename(file_path) + ".txt"
 
     if check_s3_for_text_file(bucket_name, s3_key):
-        print(f"Text file {s3_key} already exists in bucket {bucket_name}. Downloading and using as context.")
+        logger.debug("Text file %s already exists in bucket %s. Downloading and using as context.", s3_key, bucket_name)
         all_text = download_text_file_from_s3(bucket_name, s3_key)
     else:
-        print(f"Text file {s3_key} does not exist in bucket {bucket_name}. Processing and uploading.")
+        logger.debug("Text file %s does not exist in bucket %s. Processing and uploading.", s3_key, bucket_name)
         upload_doc_to_s3(file_path, bucket_name, os.path.basename(file_path))
         all_text = process_pdf_with_textract(file_path, bucket_name)
         upload_text_to_s3(all_text, bucket_name, s3_key)
@@ -3,6 +3,8 @@ import boto3
 import json
 import yaml
 import glob, shutil
+import hashlib
+from functools import lru_cache
 from typing import List
 
 def get_region():
@@ -12,12 +14,25 @@ def get_region():
     
     return region
 
+# Function to get a boto3 client, created once per service and reused across calls
+@lru_cache(maxsize=None)
+def get_client(service_name):
+    return boto3.client(service_name)
+
 # Function to read a document return its contents as bytes
 def read_document(path):
     with open(path, "rb") as doc_file:
         doc_bytes = doc_file.read()
     return doc_bytes
 
+# Function to compute a BLAKE2b content digest of a file, read in 1 MB chunks
+def file_digest(path):
+    digest = hashlib.blake2b()
+    with open(path, "rb") as doc_file:
+        for chunk in iter(lambda: doc_file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
 # Function to read a YAML file and return its contents
 def read_yaml(path):
     try:
@@ -1,14 +1,20 @@
 import re
-from itertools import product
 from operator import itemgetter
 from nltk.corpus import stopwords
 from string import punctuation
 from itertools import chain
+from functools import lru_cache
 
+try:
+    import ahocorasick
+except ImportError:  # optional, token_hits falls back to regex
+    ahocorasick = None
 
-# Function to get a set of English stop words
+
+# Function to get a set of English stop words, loaded from the corpus once
+@lru_cache(maxsize=None)
 def stop_words():
-    return set(stopwords.words("english"))
+    return frozenset(stopwords.words("english"))
 
 
 # Function to remove duplicates from a list while preserving order
@@ -39,134 +45,109 @@ def tokenize(text):
     return dedup(tokens)
 
 
-# Function to tokenize text into words, removing stop words and punctuation
+# Function to tokenize text into words, removing stop words and punctuation.
+# Results are cached, so a tuple is returned to keep them immutable.
+@lru_cache(maxsize=256)
 def text_tokenizer(text):
     tokens = text.split()
     tokens = [t for t in tokens if len(t) > 1]
-    tokens = [t for t in tokens if t.lower() not in stop_words()]
+    stops = stop_words()
+    tokens = [t for t in tokens if t.lower() not in stops]
     tokens = [x.strip(punctuation) for x in tokens]
     tokens = [x.strip() for x in tokens]
     tokens = [x for x in tokens if x]
-    return dedup(tokens)
+    return tuple(dedup(tokens))
 
 
-# Function to find the most compact span of text containing all tokens in order
-def spans_of_tokens_ordered(text, tokens):
+def merge_spans(spans):
     """
-    Get most compact span of text
-    containing tokens preserving the order of tokens
-    Returns a list of offsets [i,j]
+    Merge overlapping or touching spans.
+    Returns a sorted list of offsets [i,j]
     """
-
-    # Exclude not present tokens
-    text_lo = text.lower()
-    tokens = [t for t in tokens if t.lower() in text_lo]
-    if not tokens:
-        return []
-
-    # Backtracking
-    def bfs(text, tokens, path, solutions):
-        tabs = len(tokens)
-
-        if not tokens:
-            solutions += (path,)
-        elif not text:
-            pass
+    merged = []
+    for i, j in sorted(spans):
+        if merged and i <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], j))
         else:
-            t = tokens[0]
-            after = path[-1][0] if path else 0
-            indices = [
-                (m.start(), m.end()) for m in re.finditer(t, text, flags=re.IGNORECASE)
-            ]
-            indices = [(i, j) for i, j in indices if i >= after]
+            merged.append((i, j))
+    return merged
 
-            for i, j in indices:
-                bfs(text, tokens[1:], path + [(i, j)], solutions)
 
-    # Collect all solutions
-    solutions = []
-    bfs(text, tokens, [], solutions)
-
-    # Most compact solution
-    solutions = [x for x in solutions if x]
-    solution = min(solutions, key=lambda xs: xs[-1][1] - xs[0][0], default=[])
-    return solution
-
-
-# Function to find the most compact span containing all tokens, without order
-def spans_of_tokens_compact(text, tokens):
+def token_hits(text, tokens):
     """
-    Find most compact span containing all the tokens.
-    Returns a list of offsets [i,j]
+    Find every occurrence of the tokens in a single
+    Aho-Corasick scan of the text, case insensitive.
+    Returns a list of (i, j, token index) sorted by offset
     """
-    # Exclude not present tokens
-    text_lo = text.lower()
-    tokens = [t for t in tokens if t.lower() in text_lo]
+    tokens = dedup([t.lower() for t in tokens if len(t) > 1])
     if not tokens:
         return []
 
-    occurrences = [
-        [(m.start(), m.end()) for m in re.finditer(t, text, flags=re.IGNORECASE)]
-        for t in tokens
-    ]
-
-    solutions = product(*occurrences)
-    solutions = [s for s in solutions if len(s) == len(tokens)]
-    if not solutions:
-        return []
-
-    ranges = [
-        (min(s, key=itemgetter(0)), max(s, key=itemgetter(0)), i)
-        for i, s in enumerate(solutions)
-    ]
-
-    # Most compact range
-    compact = min(ranges, key=lambda xs: xs[1][1] - xs[0][0])
-    i = compact[2]
-    return sorted(solutions[i], key=itemgetter(0))
-
-
-def spans_of_tokens_all(text, tokens):
+    text_lo = text.lower()
+    # str.lower() can change the length of some unicode text, which would shift offsets
+    if ahocorasick is None or len(text_lo) != len(text):
+        # Single regex pass; the lookahead reports overlapping hits like the automaton.
+        # It only yields the longest token at each offset, so shorter tokens that are
+        # prefixes of it are added back from the prefix table.
+        index = {t: n for n, t in enumerate(tokens)}
+        prefixes = {t: [u for u in tokens if u != t and t.startswith(u)] for t in tokens}
+        pattern = "|".join(re.escape(t) for t in sorted(tokens, key=len, reverse=True))
+        pattern = re.compile(f"(?=({pattern}))", re.IGNORECASE)
+        hits = []
+        for m in pattern.finditer(text):
+            i, j = m.span(1)
+            t = m.group(1).lower()
+            hits.append((i, j, index.get(t)))
+            hits.extend((i, i + len(u), index[u]) for u in prefixes.get(t, ()))
+        hits.sort(key=itemgetter(0, 1))
+        return hits
+
+    automaton = ahocorasick.Automaton()
+    for n, t in enumerate(tokens):
+        automaton.add_word(t, (n, len(t)))
+    automaton.make_automaton()
+
+    hits = [(end - size + 1, end + 1, n) for end, (n, size) in automaton.iter(text_lo)]
+    hits.sort()
+    return hits
+
+
+def spans_of_tokens_ac(text, tokens):
     """
     Find all the spans containing the tokens.
-    Returns a list of offsets [i,j]
+    Returns a sorted list of non-overlapping offsets [i,j]
     """
-    # Exclude not present tokens
-    text_lo = text.lower()
-    tokens = [t for t in tokens if t.lower() in text_lo]
-    tokens = [t for t in tokens if len(t) > 1]
-    if not tokens:
-        return []
-
-    occurrences = []
-    for t in tokens:
-        try:
-            # Escape special characters in the token
-            escaped_token = re.escape(t)
-            matches = [(m.start(), m.end()) for m in re.finditer(escaped_token, text, flags=re.IGNORECASE)]
-            occurrences.extend(matches)
-        except re.error as e:
-            print(f"Error with token '{t}': {e}")
+    return merge_spans((i, j) for i, j, _ in token_hits(text, tokens))
 
-    return occurrences
 
-
-def spans_of_tokens_all(text, tokens):
+def spans_of_tokens_ac_compact(text, tokens):
     """
-    Find all the spans containing the tokens.
-    Returns a list of offsets [i,j]
+    Find the most compact window of the text containing every
+    token present, in linear time over the token hits.
+    Returns a sorted list of non-overlapping offsets [i,j] inside that window
     """
-    # Exclude not present tokens
-    text_lo = text.lower()
-    tokens = [t for t in tokens if t.lower() in text_lo and len(t) > 1]
-    if not tokens:
-        return []
-
-    # Combine tokens into a single regex pattern
-    pattern = '|'.join(re.escape(t) for t in tokens)
-    pattern = re.compile(pattern, re.IGNORECASE)
-
-    # Find all matches in a single pass
-    occurrences = [m.span() for m in pattern.finditer(text)]
-
-    return occurrences
\ No newline at end of file
+    hits = token_hits(text, tokens)
+    need = len({n for _, _, n in hits if n is not None})
+    if not need:
+        return merge_spans((i, j) for i, j, _ in hits)
+
+    # Sliding window over the hits, shrunk from the left while it still covers every token
+    counts, covered, lo = {}, 0, 0
+    best = (0, len(hits))
+    best_width = None
+    for hi, (_, j, n) in enumerate(hits):
+        if n is None:
+            continue
+        counts[n] = counts.get(n, 0) + 1
+        covered += counts[n] == 1
+        while covered == need:
+            width = j - hits[lo][0]
+            if best_width is None or width < best_width:
+                best, best_width = (lo, hi + 1), width
+            m = hits[lo][2]
+            lo += 1
+            if m is not None:
+                counts[m] -= 1
+                covered -= counts[m] == 0
+
+    return merge_spans((i, j) for i, j, _ in hits[best[0]:best[1]])